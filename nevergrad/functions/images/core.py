@@ -4,6 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import os
+import functools
 import itertools
 from pathlib import Path
 
@@ -14,7 +15,7 @@ import torch.nn as nn
 import torch
 import torchvision
 from torchvision.models import resnet50
-import torchvision.transforms as tr
+import torchvision.transforms.functional as trf
 
 import nevergrad as ng
 import nevergrad.common.typing as tp
@@ -25,6 +26,17 @@ from . import imagelosses
 # pylint: disable=abstract-method,too-many-instance-attributes,too-many-arguments
 
 
+@functools.lru_cache(maxsize=None)
+def _load_reference(path: Path, shape: tp.Tuple[int, int]) -> np.ndarray:
+    """Loads a RGB image resized to the provided (width, height) shape, with pixels between 0 and 255.
+    The output is cached and read-only since it is shared between all the calls.
+    """
+    image = PIL.Image.open(path).resize(shape, PIL.Image.LANCZOS)  # same filter as the former ANTIALIAS
+    data = np.asarray(image)[:, :, :3]  # 4th Channel is pointless here, only 255.
+    data.setflags(write=False)
+    return data  # type: ignore
+
+
 class Image(base.ExperimentFunction):
     def __init__(
         self,
@@ -33,6 +45,7 @@ class Image(base.ExperimentFunction):
         loss: tp.Type[imagelosses.ImageLoss] = imagelosses.SumAbsoluteDifferences,
         with_pgan: bool = False,
         num_images: int = 1,
+        use_gpu: bool = False,
     ) -> None:
         """
         problem_name: the type of problem we are working on.
@@ -40,6 +53,7 @@ class Image(base.ExperimentFunction):
         index: the index of the problem, inside the problem type.
            For example, if problem_name is "recovering" and index == 0,
            we try to recover the face of O. Teytaud.
+        use_gpu: whether to use gpus (if available) to generate the images with the GAN.
         """
 
         # Storing high level information.
@@ -54,8 +68,8 @@ class Image(base.ExperimentFunction):
         assert index == 0  # For the moment only 1 target.
         # path = os.path.dirname(__file__) + "/headrgb_olivier.png"
         path = Path(__file__).with_name("headrgb_olivier.png")
-        image = PIL.Image.open(path).resize((self.domain_shape[0], self.domain_shape[1]), PIL.Image.ANTIALIAS)
-        self.data = np.asarray(image)[:, :, :3]  # 4th Channel is pointless here, only 255.
+        self.data = _load_reference(path, (self.domain_shape[0], self.domain_shape[1]))
+        self.loss_function = loss(reference=self.data)
         # parametrization
         if not with_pgan:
             assert num_images == 1
@@ -64,14 +78,14 @@ class Image(base.ExperimentFunction):
             array.set_bounds(lower=0, upper=255.99, method="clipping", full_range_sampling=True)
             max_size = ng.p.Scalar(lower=1, upper=200).set_integer_casting()
             array = ng.ops.mutations.Crossover(axis=(0, 1), max_size=max_size)(array).set_name("")  # type: ignore
-            super().__init__(loss(reference=self.data), array)
+            super().__init__(self.loss_function, array)
         else:
             self.pgan_model = torch.hub.load(
                 "facebookresearch/pytorch_GAN_zoo:hub",
                 "PGAN",
                 model_name="celebAHQ-512",
                 pretrained=True,
-                useGPU=False,
+                useGPU=use_gpu and torch.cuda.is_available(),
             )
             self.domain_shape = (num_images, 512)  # type: ignore
             initial_noise = np.random.normal(size=self.domain_shape)
@@ -80,17 +94,16 @@ class Image(base.ExperimentFunction):
             array = ng.p.Array(init=initial_noise, mutable_sigma=True)
             array.set_mutation(sigma=35.0)
             array = ng.ops.mutations.Crossover(axis=(0, 1))(array).set_name("")
-            self._descriptors.pop("use_gpu", None)
             super().__init__(self._loss_with_pgan, array)
 
+        self._descriptors.pop("use_gpu", None)
         assert self.multiobjective_upper_bounds is None
         self.add_descriptors(loss=loss.__class__.__name__)
-        self.loss_function = loss(reference=self.data)
 
+    @torch.no_grad()
     def _generate_images(self, x: np.ndarray) -> np.ndarray:
         """Generates images tensor of shape [nb_images, x, y, 3] with pixels between 0 and 255"""
-        # pylint: disable=not-callable
-        noise = torch.tensor(x.astype("float32"))
+        noise = torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32))  # no copy if already float32
         return (
             ((self.pgan_model.test(noise).clamp(min=-1, max=1) + 1) * 255.99 / 2)
             .permute(0, 2, 3, 1)
@@ -143,21 +156,55 @@ class Image(base.ExperimentFunction):
 class Normalize(nn.Module):
     def __init__(self, mean: tp.ArrayLike, std: tp.ArrayLike) -> None:
         super().__init__()
-        self.mean = torch.Tensor(mean)
-        self.std = torch.Tensor(std)
+        mean_ = torch.Tensor(mean).view(1, -1, 1, 1)  # shaped for broadcasting over NCHW batches
+        std_ = torch.Tensor(std).view(1, -1, 1, 1)
+        # (x - mean) / std == x * scale + shift, computed in one fused multiply-add
+        # buffers follow the module dtype/device
+        self.register_buffer("scale", 1.0 / std_)
+        self.register_buffer("shift", -mean_ / std_)
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        return (x - self.mean.type_as(x)[None, :, None, None]) / self.std.type_as(x)[None, :, None, None]
+        return torch.addcmul(self.shift, x, self.scale)
 
 
 class Resnet50(nn.Module):
-    def __init__(self) -> None:
+    """Pretrained Resnet50 classifier, including input normalization
+
+    Parameters
+    ----------
+    half: bool
+        whether to run the inference in half precision (only worth it on GPUs with tensor cores).
+        Inputs are cast to the precision of the model and outputs are returned as float32.
+    jit: bool
+        whether to run a frozen TorchScript version of the network, traced at the first call for each input shape
+        (this fuses convolutions and batch norms). The model must not be modified/moved after the first call.
+    channels_last: bool
+        whether to run the convolutions in NHWC memory format, which is the native format of tensor cores
+        and oneDNN kernels. Inputs are converted to this format before going through the network.
+    """
+
+    def __init__(self, half: bool = False, jit: bool = False, channels_last: bool = False) -> None:
         super().__init__()
         self.norm = Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        self.model = resnet50(pretrained=True)
+        self.model = resnet50(pretrained=True).eval()  # weights are never trained here
+        if half:
+            self.half()
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.model.to(memory_format=self.memory_format)
+        self.jit = jit
+        self._traced: tp.Dict[tp.Tuple[int, ...], tp.Any] = {}
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        return self.model(self.norm(x))
+        dtype = self.model.conv1.weight.dtype
+        x = self.norm(x.to(dtype)).contiguous(memory_format=self.memory_format)
+        model: tp.Any = self.model
+        if self.jit:
+            shape = tuple(x.shape)
+            if shape not in self._traced:
+                with torch.no_grad():
+                    self._traced[shape] = torch.jit.freeze(torch.jit.trace(self.model, x))
+            model = self._traced[shape]
+        return model(x).float()
 
 
 class TestClassifier(nn.Module):
@@ -169,6 +216,13 @@ class TestClassifier(nn.Module):
         return self.model(x.view(x.shape[0], -1))
 
 
+def _to_centered_tensor(image: PIL.Image.Image, imsize: int) -> torch.Tensor:
+    """Equivalent to tr.Compose([tr.Resize(imsize), tr.CenterCrop(imsize), tr.ToTensor()])
+    without the generic composition overhead
+    """
+    return trf.to_tensor(trf.center_crop(trf.resize(image, imsize), imsize))
+
+
 # pylint: disable=too-many-arguments,too-many-instance-attributes
 class ImageAdversarial(base.ExperimentFunction):
     def __init__(
@@ -188,9 +242,13 @@ class ImageAdversarial(base.ExperimentFunction):
         self.image = image  # if (image is not None) else torch.rand((3, 224, 224))
         self.label = torch.Tensor([label])  # if (label is not None) else torch.Tensor([0])
         self.label = self.label.long()
-        self.classifier = classifier  # if (classifier is not None) else Classifier()
+        self.classifier = classifier.eval()  # if (classifier is not None) else Classifier()
         self.criterion = nn.CrossEntropyLoss()
         self.imsize = self.image.shape[1]
+        # keep the tensors on the device of the classifier, the image is prepared as a batch of 1 image
+        device = next(iter(self.classifier.parameters()), self.image).device
+        self.label = self.label.to(device)
+        self._image = self.image.to(device).unsqueeze(0)
 
         array = ng.p.Array(
             init=np.zeros(self.image.shape),
@@ -208,11 +266,30 @@ class ImageAdversarial(base.ExperimentFunction):
         value = float(self.criterion(output_adv, self.label).item())
         return value * (1.0 if self.targeted else -1.0)
 
+    def loss_batch(self, xs: np.ndarray) -> np.ndarray:
+        """Computes the losses of a batch of perturbations through a single call to the classifier
+
+        Parameters
+        ----------
+        xs: np.ndarray
+            batch of perturbations, of shape [N, 3, imsize, imsize]
+
+        Returns
+        -------
+        np.ndarray
+            the N losses, equal to the ones the function provides for each perturbation independently
+        """
+        output_adv = self._get_classifier_output(xs)
+        labels = self.label.expand(output_adv.shape[0])
+        values = nn.functional.cross_entropy(output_adv, labels, reduction="none").cpu().numpy()
+        return values * (1.0 if self.targeted else -1.0)  # type: ignore
+
+    @torch.no_grad()
     def _get_classifier_output(self, x: np.ndarray) -> tp.Any:
-        # call to the classifier given the input array
-        y = torch.Tensor(x)
-        image_adv = torch.clamp(self.image + y, 0, 1)
-        image_adv = image_adv.view(1, 3, self.imsize, self.imsize)
+        # call to the classifier given the input array (or a batch of input arrays)
+        y = torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32))
+        y = y.to(self._image.device, non_blocking=True).view(-1, 3, self.imsize, self.imsize)
+        image_adv = (self._image + y).clamp_(0, 1)
         return self.classifier(image_adv)
 
     def evaluation_function(self, *recommendations: ng.p.Parameter) -> float:
@@ -247,22 +324,31 @@ class ImageAdversarial(base.ExperimentFunction):
         assert model in {"resnet50", "test"}
         tags = {"folder": "#FAKE#" if folder is None else Path(folder).name, "model": model}
         classifier: tp.Any = Resnet50() if model == "resnet50" else TestClassifier()
+        device = next(iter(classifier.parameters()), torch.empty(0)).device
         imsize = 224
-        transform = tr.Compose([tr.Resize(imsize), tr.CenterCrop(imsize), tr.ToTensor()])
+        transform = functools.partial(_to_centered_tensor, imsize=imsize)
         if folder is None:
             x = torch.zeros(1, 3, 224, 224)
-            _, pred = torch.max(classifier(x), axis=1)
-            data_loader: tp.Iterable[tp.Tuple[tp.Any, tp.Any]] = [(x, pred)]
+            with torch.no_grad():
+                _, pred = torch.max(classifier(x.to(device)), axis=1)
+            data_loader: tp.Iterable[tp.Tuple[tp.Any, tp.Any]] = [(x, pred.cpu())]
         elif Path(folder).is_dir():
             ifolder = torchvision.datasets.ImageFolder(folder, transform)
-            data_loader = torch.utils.DataLoader(
-                ifolder, batch_size=1, shuffle=True, num_workers=8, pin_memory=True
+            data_loader = torch.utils.data.DataLoader(
+                ifolder,
+                batch_size=1,
+                shuffle=True,
+                num_workers=min(8, os.cpu_count() or 1),
+                prefetch_factor=4,
+                pin_memory=device.type == "cuda",  # only useful with non-blocking copies to the gpu
             )
         else:
             raise ValueError(f"{folder} is not a valid folder.")
         for data, target in itertools.islice(data_loader, 0, 100):
-            _, pred = torch.max(classifier(data), axis=1)
-            if pred == target:
+            data = data.to(device, non_blocking=True)
+            with torch.no_grad():
+                _, pred = torch.max(classifier(data), axis=1)
+            if int(pred) == int(target):
                 func = cls(
                     classifier=classifier, image=data[0], label=int(target), targeted=False, epsilon=0.05
                 )
@@ -288,6 +374,9 @@ class ImageFromPGAN(base.ExperimentFunction):
         whether the sigma should be mutable
     sigma: float
         standard deviation of the initial mutations
+    cuda_graph: bool
+        whether to capture the generator in a CUDA graph at the first call and replay it afterwards,
+        which removes the kernel launch overheads (gpu only, requires torch>=1.10)
     """
 
     def __init__(
@@ -297,11 +386,15 @@ class ImageFromPGAN(base.ExperimentFunction):
         loss: tp.Optional[imagelosses.ImageLoss] = None,
         mutable_sigma: bool = True,
         sigma: float = 35,
+        cuda_graph: bool = False,
     ) -> None:
         if loss is None:
             loss = imagelosses.Koncept512()
-        if not torch.cuda.is_available():
-            use_gpu = False
+        use_gpu = use_gpu and torch.cuda.is_available()
+        if cuda_graph and not (use_gpu and hasattr(torch.cuda, "CUDAGraph")):
+            raise errors.UnsupportedExperiment(
+                "CUDA graphs require use_gpu with an available gpu and torch>=1.10"
+            )
         # Storing high level information..
         if os.environ.get("CIRCLECI", False):
             raise errors.UnsupportedExperiment("ImageFromPGAN is not well supported in CircleCI")
@@ -321,6 +414,16 @@ class ImageFromPGAN(base.ExperimentFunction):
             f"it should be {self.domain_shape}"
         )
 
+        # noise buffer reused at each evaluation (pinned for faster host to device transfers)
+        self._noise = torch.empty(self.domain_shape, dtype=torch.float32, pin_memory=use_gpu)
+        # pinned buffer for retrieving the images from the gpu, allocated at the first call
+        self._host_images: tp.Optional[torch.Tensor] = None
+        # CUDA graph of the generator and its static input/output, captured at the first call
+        self._cuda_graph = cuda_graph
+        self._graph: tp.Any = None
+        self._graph_noise: tp.Optional[torch.Tensor] = None
+        self._graph_images: tp.Optional[torch.Tensor] = None
+
         array = ng.p.Array(init=initial_noise, mutable_sigma=mutable_sigma)
         # parametrization
         array.set_mutation(sigma=sigma)
@@ -328,17 +431,68 @@ class ImageFromPGAN(base.ExperimentFunction):
 
         super().__init__(self._loss, array)
         self.loss_function = loss
-        self._descriptors.pop("use_gpu", None)
+        for name in ("use_gpu", "cuda_graph"):  # they do not change the function
+            self._descriptors.pop(name, None)
 
         self.add_descriptors(loss=loss.__class__.__name__)
 
     def _loss(self, x: np.ndarray) -> float:
-        image = self._generate_images(x)
+        # the images are only used by the loss, so they can be retrieved in the reusable host buffer
+        image = self._to_host_buffer(self._generate_tensor(x))
         loss = self.loss_function(image)
         return loss
 
     def _generate_images(self, x: np.ndarray) -> np.ndarray:
         """Generates images tensor of shape [nb_images, x, y, 3] with pixels between 0 and 255"""
-        # pylint: disable=not-callable
-        noise = torch.tensor(x.astype("float32"))
-        return ((self.pgan_model.test(noise).clamp(min=-1, max=1) + 1) * 255.99 / 2).permute(0, 2, 3, 1).cpu().numpy()  # type: ignore
+        return self._generate_tensor(x).cpu().numpy()  # type: ignore
+
+    @torch.no_grad()
+    def _generate_tensor(self, x: np.ndarray) -> torch.Tensor:
+        """Generates images tensor of shape [nb_images, x, y, 3] with pixels between 0 and 255,
+        on the device of the generator
+        Note: when using CUDA graphs, the output is a view on a tensor which is overwritten at each call.
+        """
+        self._noise.numpy()[...] = x  # copies (and casts if need be) without reallocating
+        if self._cuda_graph:
+            images = self._replay_graph()
+        else:
+            images = self._postprocess(self.pgan_model.test(self._noise, toCPU=False))
+        return images.permute(0, 2, 3, 1)
+
+    def _to_host_buffer(self, images: torch.Tensor) -> np.ndarray:
+        """Retrieves the images as a numpy array
+        Note: when using gpus, the output is a view on a buffer which is overwritten at each call.
+        """
+        if images.is_cuda:
+            if self._host_images is None:
+                self._host_images = torch.empty(images.shape, dtype=images.dtype, pin_memory=True)
+            images = self._host_images.copy_(images)  # page-locked memory allows for a direct DMA copy
+        return images.numpy()  # type: ignore
+
+    @staticmethod
+    def _postprocess(images: torch.Tensor) -> torch.Tensor:
+        return (images.clamp(min=-1, max=1) + 1) * 255.99 / 2
+
+    def _replay_graph(self) -> torch.Tensor:
+        """Runs the generator (and the post-processing) on the current noise through a CUDA graph,
+        which is captured at the first call. The output is a static tensor on the gpu.
+        """
+        if self._graph is None:
+            netG = self.pgan_model.netG  # this is what PGAN.test runs
+            if isinstance(netG, nn.DataParallel):  # multi-gpu replication cannot be captured
+                netG = netG.module
+            self._graph_noise = self._noise.to(self.pgan_model.device)
+            # warm up on a side stream before capture, as required by CUDA graphs
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                for _ in range(3):
+                    netG(self._graph_noise)
+            torch.cuda.current_stream().wait_stream(stream)
+            self._graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(self._graph):
+                self._graph_images = self._postprocess(netG(self._graph_noise))
+        assert self._graph_noise is not None and self._graph_images is not None
+        self._graph_noise.copy_(self._noise, non_blocking=True)
+        self._graph.replay()
+        return self._graph_images
@@ -25,7 +25,8 @@ class ImageLoss:
 
     def __init__(self, reference: tp.Optional[np.ndarray] = None) -> None:
         if reference is not None:
-            self.reference = reference
+            # contiguous memory for faster element-wise sweeps (slices such as img[:, :, :3] are strided)
+            self.reference = np.ascontiguousarray(reference)
             assert len(self.reference.shape) == 3, self.reference.shape
             assert self.reference.min() >= 0.0
             assert self.reference.max() <= 256.0, f"Image max = {self.reference.max()}"
@@ -38,9 +39,21 @@ class ImageLoss:
 
 @registry.register
 class SumAbsoluteDifferences(ImageLoss):
+    """Sum of the absolute differences with the reference.
+    Note: computations go through a buffer which is reused at each call to avoid temporary allocations,
+    hence a same instance must not be called from several threads at once (use a copy for each thread).
+    """
+
+    def __init__(self, reference: tp.Optional[np.ndarray] = None) -> None:
+        super().__init__(reference)
+        self._buffer: tp.Optional[np.ndarray] = None  # allocated at the first call
+
     def __call__(self, x: np.ndarray) -> float:
         assert x.shape == self.domain_shape, f"Shape = {x.shape} vs {self.domain_shape}"
-        value = float(np.sum(np.fabs(x - self.reference)))
+        if self._buffer is None:
+            self._buffer = np.empty(self.domain_shape)
+        np.subtract(x, self.reference, out=self._buffer)
+        value = float(np.sum(np.fabs(self._buffer, out=self._buffer)))
         return value
 
 
@@ -3,9 +3,18 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+from pathlib import Path
+from unittest.mock import patch
+import pytest
 import numpy as np
-
+import PIL.Image
+import torch
+import torchvision
+from torch import nn
+import nevergrad.common.typing as tp
+from nevergrad.common import errors
 from . import core
+from . import imagelosses
 
 
 def test_images_adversarial() -> None:
@@ -19,6 +28,14 @@ def test_images_adversarial() -> None:
     assert value2 == value  # same function
 
 
+def test_images_adversarial_batch() -> None:
+    func = next(core.ImageAdversarial.make_folder_functions(None, model="test"))
+    xs = np.random.uniform(-func.epsilon, func.epsilon, size=(4,) + tuple(func.image.shape))
+    values = func.loss_batch(xs)
+    assert values.shape == (4,)
+    np.testing.assert_almost_equal(values, [func._loss(x) for x in xs], decimal=5)
+
+
 def test_image_adversarial_eval() -> None:
     func = next(core.ImageAdversarial.make_folder_functions(None, model="test"))
     output = func.evaluation_function(func.parametrization)
@@ -28,6 +45,66 @@ def test_image_adversarial_eval() -> None:
     assert output == 0
 
 
+class _FirstClassClassifier(core.TestClassifier):
+    """Test classifier always predicting the first class"""
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        output = super().forward(x)
+        output[:, 0] = output.abs().sum() + 1
+        return output
+
+
+def test_images_adversarial_folder(tmp_path: Path) -> None:
+    for cls, num in [("class0", 2), ("class1", 1)]:
+        (tmp_path / cls).mkdir()
+        for k in range(num):
+            image = np.random.randint(0, 256, size=(250, 300, 3), dtype=np.uint8)
+            PIL.Image.fromarray(image).save(tmp_path / cls / f"image{k}.png")
+    with patch.object(core, "TestClassifier", _FirstClassClassifier):
+        funcs = list(core.ImageAdversarial.make_folder_functions(tmp_path, model="test"))
+    assert len(funcs) == 2  # only the correctly classified images
+    for func in funcs:
+        assert func.image.shape == (3, 224, 224)
+        assert 0 <= float(func.image.min()) <= float(func.image.max()) <= 1
+        assert int(func.label) == 0
+        assert func.descriptors["folder"] == tmp_path.name
+        assert isinstance(func(np.zeros(func.image.shape)), float)
+
+
+def _make_resnet50(**kwargs: tp.Any) -> core.Resnet50:
+    torch.manual_seed(12)  # same random weights for all the instances
+    with patch.object(core, "resnet50", lambda pretrained: torchvision.models.resnet50()):
+        return core.Resnet50(**kwargs)
+
+
+def test_resnet50_half() -> None:
+    net = _make_resnet50(half=True)
+    assert net.model.conv1.weight.dtype == torch.float16
+    with torch.no_grad():
+        output = net(torch.rand(2, 3, 64, 64))
+    assert output.dtype == torch.float32
+    assert output.shape == (2, 1000)
+
+
+def test_resnet50_jit() -> None:
+    eager = _make_resnet50()
+    net = _make_resnet50(jit=True)
+    with torch.no_grad():
+        for batch_size in [1, 2, 2]:
+            x = torch.rand(batch_size, 3, 64, 64)
+            np.testing.assert_allclose(net(x).numpy(), eager(x).numpy(), atol=1e-4)
+    assert set(net._traced) == {(1, 3, 64, 64), (2, 3, 64, 64)}  # one trace per input shape
+
+
+def test_resnet50_channels_last() -> None:
+    eager = _make_resnet50()
+    net = _make_resnet50(channels_last=True)
+    assert net.model.conv1.weight.is_contiguous(memory_format=torch.channels_last)
+    x = torch.rand(2, 3, 64, 64)
+    with torch.no_grad():
+        np.testing.assert_allclose(net(x).numpy(), eager(x).numpy(), atol=1e-4)
+
+
 def test_images() -> None:
     func = core.Image()
     x = 7 * np.fabs(np.random.normal(size=func.domain_shape))
@@ -38,3 +115,51 @@ def test_images() -> None:
     other_func = func.copy()
     value2 = other_func(x)
     assert value == value2
+
+
+class _FakePGAN:
+    """Tiny stand-in for pytorch_GAN_zoo's PGAN, generating 8x8 images"""
+
+    def __init__(self) -> None:
+        self.device = torch.device("cpu")
+        self.netG = nn.Sequential(nn.Linear(512, 3 * 8 * 8), nn.Unflatten(1, (3, 8, 8)))
+
+    def test(self, _input: torch.Tensor, _getAvG: bool = False, toCPU: bool = True) -> torch.Tensor:
+        out = self.netG(_input.to(self.device)).detach()
+        return out.cpu() if toCPU else out
+
+
+class _MeanLoss(imagelosses.ImageLoss):
+
+    REQUIRES_REFERENCE = False
+
+    def __call__(self, img: np.ndarray) -> float:
+        return float(np.mean(img))
+
+
+def _make_pgan_function(**kwargs: tp.Any) -> core.ImageFromPGAN:
+    with patch.dict("os.environ", {"CIRCLECI": ""}):
+        with patch("torch.hub.load", side_effect=lambda *args, **kw: _FakePGAN()):
+            return core.ImageFromPGAN(loss=_MeanLoss(), **kwargs)
+
+
+def test_image_from_pgan() -> None:
+    func = _make_pgan_function()
+    x = np.random.normal(size=func.domain_shape)
+    images = func._generate_images(x)
+    assert images.shape == (1, 8, 8, 3)
+    with torch.no_grad():
+        noise = torch.tensor(x.astype("float32"))
+        expected = ((func.pgan_model.test(noise).clamp(min=-1, max=1) + 1) * 255.99 / 2).permute(0, 2, 3, 1)
+    np.testing.assert_array_almost_equal(images, expected.numpy(), decimal=4)
+    value = func(x)
+    assert isinstance(value, float)
+    assert value == func.loss_function(func._generate_images(x))
+    assert "cuda_graph" not in func.descriptors
+
+
+def test_image_from_pgan_cuda_graph_requires_gpu() -> None:
+    if torch.cuda.is_available():
+        raise pytest.skip("Only relevant without gpu")
+    with pytest.raises(errors.UnsupportedExperiment):
+        _make_pgan_function(cuda_graph=True)
@@ -22,6 +22,8 @@ def test_reference() -> None:
 def test_l1_loss() -> None:
     loss = imagelosses.SumAbsoluteDifferences(reference=124.0 * np.ones((300, 400, 3)))
     assert loss(np.ones((300, 400, 3))) == 44280000.0
+    assert loss(np.ones((300, 400, 3))) == 44280000.0  # buffer reuse
+    imagelosses.SumAbsoluteDifferences()  # no reference required for instantiation
 
 
 @pytest.mark.parametrize("loss_name", imagelosses.registry)  # type: ignore
@@ -266,10 +266,23 @@ class Bound(BoundLayer):
         self._method = method
         self._transform = transforms[method](*self.bounds)
         self.set_name(self._transform.name)
+        # used when the data can be clipped in place (see _layered_get_value)
+        self._inplace_transform = trans.Clipping(*self.bounds, inplace=True) if method == "clipping" else None
 
     def _layered_get_value(self) -> np.ndarray:
         deep_value = super()._layered_get_value()
-        value = self._transform.forward(deep_value)
+        root = self._layers[0]
+        if (
+            self._inplace_transform is not None
+            and isinstance(root, Data)
+            and deep_value is root._value
+            and not root._frozen
+        ):
+            # the data is the array of the (modifiable) root parameter, which would be reset
+            # with the clipped value anyway, so it can be clipped in place to avoid an allocation
+            value = self._inplace_transform.forward(deep_value)
+        else:
+            value = self._transform.forward(deep_value)
         if deep_value is not value and self._method in ("clipping", "bouncing"):  # refresh if need be
             # resetting
             super()._layered_set_value(value)
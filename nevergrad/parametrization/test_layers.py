@@ -89,6 +89,26 @@ def test_clipping_standardized_data() -> None:
     assert x.value == 10
 
 
+def test_clipping_stacked_and_frozen() -> None:
+    # data below a layer is a temporary array, the clipped value must be propagated to the root
+    x = (ng.p.Array(init=np.array([1.0, 2.0])) * 2.0).set_bounds(0, 5, method="clipping")
+    for _ in range(2):
+        x.set_standardized_data([10, -10])
+        np.testing.assert_array_equal(x.value, [5, 0])
+        np.testing.assert_array_equal(x._value, [2.5, 0])
+    # data of a root parameter is clipped in place
+    y = ng.p.Array(init=np.array([1.0, 2.0])).set_bounds(0, 5, method="clipping")
+    y.set_standardized_data([10, -10])
+    np.testing.assert_array_equal(y._value, [5, 0])
+    assert y.value is y._value
+    # frozen data must not be modified
+    y._value = np.array([7.0, 1.0])
+    y.freeze()
+    with pytest.raises(RuntimeError):
+        y.value  # pylint: disable=pointless-statement
+    np.testing.assert_array_equal(y._value, [7, 1])
+
+
 def test_bound_estimation() -> None:
     param = (_datalayers.Bound(-10, 10)(ng.p.Scalar()) + 3) * 5
     assert param.bounds == (-35, 65)  # type: ignore
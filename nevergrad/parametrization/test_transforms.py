@@ -94,3 +94,13 @@ def test_multibounds(transform_cls: tp.Type[transforms.BoundTransform], expected
 def test_clipping(transform: transforms.Transform, expected: tp.List[float]) -> None:
     y = transform.forward(np.array([-3, 5]))
     np.testing.assert_array_equal(y, expected)
+
+
+def test_clipping_inplace() -> None:
+    x = np.array([-3.0, 0.5, 5.0])
+    y = transforms.Clipping(0, 1).forward(x)
+    assert y is not x
+    np.testing.assert_array_equal(x, [-3, 0.5, 5])
+    y = transforms.Clipping(0, 1, inplace=True).forward(x)
+    assert y is x
+    np.testing.assert_array_equal(x, [0, 0.5, 1])
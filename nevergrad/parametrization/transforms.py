@@ -191,6 +191,8 @@ class Clipping(BoundTransform):
         upper bound
     bounce: bool
         bounce (once) on borders instead of just clipping
+    inplace: bool
+        clip the input array in place (if writeable and float) instead of allocating a new one (only without bouncing)
     """
 
     def __init__(
@@ -198,9 +200,11 @@ class Clipping(BoundTransform):
         a_min: BoundType = None,
         a_max: BoundType = None,
         bounce: bool = False,
+        inplace: bool = False,
     ) -> None:
         super().__init__(a_min=a_min, a_max=a_max)
         self._bounce = bounce
+        self._inplace = inplace and not bounce
         b = ",b" if bounce else ""
         self.name = f"Cl({_f(a_min)},{_f(a_max)}{b})"
         self.checker = utils.BoundChecker(self.a_min, self.a_max)
@@ -209,9 +213,11 @@ class Clipping(BoundTransform):
         self._check_shape(x)
         if self.checker(x):
             return x
+        if self._inplace and x.flags.writeable and x.dtype.kind == "f":
+            return np.clip(x, self.a_min, self.a_max, out=x)  # type: ignore
         out = np.clip(x, self.a_min, self.a_max)  # type: ignore
         if self._bounce:
-            out = np.clip(2 * out - x, self.a_min, self.a_max)  # type: ignore
+            out = np.clip(2 * out - x, self.a_min, self.a_max, out=out)  # type: ignore
         return out  # type: ignore
 
     def backward(self, y: np.ndarray) -> np.ndarray: